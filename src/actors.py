@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+from __future__ import annotations
+
+from concurrent.futures import Future
+from queue import Queue, Empty
+from threading import Thread, Condition
+from typing import Any, NamedTuple, Optional, Set, Tuple
+
+from game import Game, GameSnapshot, MapRequest, ObstacleHit, Player, Projectile
+from protocol import EncodedMessage
+from simple_logging import log
+
+
+class JoinRequest(NamedTuple):
+    client_ip_address: str
+
+
+class LeaveRequest(NamedTuple):
+    player_id: int
+
+
+class GameActor:
+    """
+    Single writer of a Game. Connections never touch the Game directly: they
+    post messages, which are handled one by one by the GameWorker owning this
+    actor, and read the last published GameSnapshot, which is immutable.
+    Each snapshot is pickled once, when published, and the same encoded
+    message is sent to all players and spectators of the Game.
+    """
+
+    def __init__(self, game: Game, worker: GameWorker):
+        self.game = game
+        self.worker = worker
+        self.published = Condition()
+        self.snapshot: GameSnapshot = game.take_snapshot()
+        self.encoded_snapshot = EncodedMessage(self.snapshot)
+
+    def post(self, message: Any):
+        self.worker.inbox.put((self, message, None))
+
+    def call(self, message: Any) -> Any:
+        """Post message and block until worker handles it, returning the result."""
+        future = Future()
+        self.worker.inbox.put((self, message, future))
+        return future.result()
+
+    def handle(self, message: Any) -> Any:
+        game = self.game
+        if isinstance(message, Player):
+            game.update_player(message)
+        elif isinstance(message, Projectile):
+            game.update_projectiles(message)
+        elif isinstance(message, ObstacleHit):
+            game.damage_obstacle(message)
+        elif isinstance(message, JoinRequest):
+            if game.can_player_join():
+                game.join_new_player(message.client_ip_address)
+                return game.last_added_player(), game.map.get_state()
+        elif isinstance(message, MapRequest):
+            return game.map.get_state()
+        elif isinstance(message, LeaveRequest):
+            return game.remove_player(message.player_id)
+        elif isinstance(message, tuple):
+            for game_object in message:
+                self.handle(game_object)
+        else:
+            log(f'Game: {game.id}, unknown message: {message}')
+
+    def publish(self):
+        snapshot = self.game.take_snapshot()
+        encoded_snapshot = EncodedMessage(snapshot)
+        with self.published:
+            self.snapshot, self.encoded_snapshot = snapshot, encoded_snapshot
+            self.published.notify_all()
+
+    def wait_for_snapshot(self, newer_than: int, timeout: float) -> Tuple[int, Optional[EncodedMessage]]:
+        """
+        Block until snapshot newer than tick 'newer_than' is published and
+        return its tick and encoded message, or return (newer_than, None) on
+        timeout.
+        """
+        with self.published:
+            if self.published.wait_for(lambda: self.snapshot.tick > newer_than, timeout):
+                return self.snapshot.tick, self.encoded_snapshot
+            return newer_than, None
+
+
+class GameWorker(Thread):
+    """
+    Handles messages posted to all GameActors assigned to it. Each Game is
+    assigned to exactly one worker, so Game is never mutated concurrently, and
+    snapshot of every Game changed by a batch of messages is published once.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name=name, daemon=True)
+        self.inbox: Queue[Tuple[GameActor, Any, Optional[Future]]] = Queue()
+
+    def run(self):
+        while True:
+            changed: Set[GameActor] = set()
+            item = self.inbox.get()
+            while item is not None:
+                changed.add(self.handle(*item))
+                try:
+                    item = self.inbox.get_nowait()
+                except Empty:
+                    item = None
+            for actor in changed:
+                actor.publish()
+
+    @staticmethod
+    def handle(actor: GameActor, message: Any, future: Optional[Future]) -> GameActor:
+        try:
+            result = actor.handle(message)
+        except Exception as e:
+            log(f'Game: {actor.game.id}, failed to handle {message}: {e}')
+            if future is not None:
+                future.set_exception(e)
+        else:
+            if future is not None:
+                future.set_result(result)
+        return actor
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+import sys
+import subprocess
+
+from pathlib import Path
+from socket import socket, create_server, create_connection, IPPROTO_TCP, TCP_NODELAY
+from statistics import median
+from threading import Thread
+from time import perf_counter
+
+SOURCE_DIRECTORY = Path(__file__).parent
+SIMULATED_TICK = 1 / 80  # seconds between snapshots of 4 players game, each player sending 20 times per second
+
+STARTUP_PROBE = """
+import sys, time, resource
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in ('arcade', 'pyglet', 'PIL', 'pymunk') if m in sys.modules]
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, ','.join(heavy) or '-')
+"""
+
+
+def measure_import(module: str, repeats: int):
+    times, memory, heavy = [], [], '-'
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE.format(module=module)],
+            cwd=SOURCE_DIRECTORY, capture_output=True, text=True, check=True
+        ).stdout.split()
+        times.append(float(output[0]))
+        memory.append(int(output[1]))
+        heavy = output[2]
+    return median(times), median(memory), heavy
+
+
+def benchmark_server_startup(repeats: int = 10):
+    """
+    Measure time of importing server entry point in a fresh interpreter and
+    the peak RSS of that interpreter. 'socket' import is a baseline of bare
+    interpreter costs.
+    """
+    for module in ('socket', 'server'):
+        elapsed, rss, heavy = measure_import(module, repeats)
+        print(f'import {module:<8} {elapsed * 1000:8.2f} ms, max RSS: {rss / 1024:6.1f} MiB, heavy modules: {heavy}')
+
+
+def benchmark_dictionary_checksum(processes: int = 2):
+    """
+    Check that independent interpreters build the same preset compression
+    dictionary, since client and server negotiate compression only when
+    their checksums match.
+    """
+    checksums = {
+        subprocess.run(
+            [sys.executable, '-c', 'from compression import dictionary_checksum; print(dictionary_checksum())'],
+            cwd=SOURCE_DIRECTORY, capture_output=True, text=True, check=True
+        ).stdout.strip() for _ in range(processes)
+    }
+    print(f'dictionary checksums of {processes} processes: {", ".join(checksums)}, '
+          f'{"identical" if len(checksums) == 1 else "DIFFERENT - compression would never be negotiated"}')
+
+
+class CountingSocket:
+    """Socket proxy counting send and receive calls, each being one syscall."""
+
+    def __init__(self, wrapped: socket):
+        self.wrapped = wrapped
+        self.syscalls = 0
+
+    def sendall(self, data) -> None:
+        self.syscalls += 1
+        self.wrapped.sendall(data)
+
+    def recv_into(self, buffer) -> int:
+        self.syscalls += 1
+        return self.wrapped.recv_into(buffer)
+
+
+def serve_frames(listener: socket, nodelay: bool):
+    from game import Player
+    from protocol import MessageReceiver, send_message
+
+    connection, _ = listener.accept()
+    connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, int(nodelay))
+    receiver = MessageReceiver(connection)
+    try:
+        while True:
+            received = receiver.receive()
+            if isinstance(received, Player) or isinstance(received, tuple) and isinstance(received[-1], Player):
+                send_message(connection, ((), ()))
+    except (EOFError, ConnectionError):
+        connection.close()
+
+
+def run_frames(batched: bool, nodelay: bool, frames: int, projectiles: int):
+    from game import Player
+    from protocol import MessageReceiver, send_message
+
+    listener = create_server(('127.0.0.1', 0))
+    Thread(target=serve_frames, args=(listener, nodelay), daemon=True).start()
+    connection = create_connection(listener.getsockname())
+    connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, int(nodelay))
+    counting = CountingSocket(connection)
+    receiver = MessageReceiver(counting)
+    player = Player(0, 0, 250, 250, 25, 35, (255, 0, 0), True)
+    latencies = []
+    for _ in range(frames):
+        start = perf_counter()
+        spawned = [player.shoot(300, 300) for _ in range(projectiles)]
+        if batched:
+            send_message(counting, (*spawned, player))
+        else:
+            for projectile in spawned:
+                send_message(counting, projectile)
+            send_message(counting, player)
+        receiver.receive()
+        latencies.append(perf_counter() - start)
+    connection.close()
+    listener.close()
+    latencies.sort()
+    return counting.syscalls / frames, median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def benchmark_frame_batching(frames: int = 500, projectiles: int = 3):
+    """
+    Compare sending each Projectile separately with sending one batch per
+    frame, with and without Nagle algorithm, over the loopback connection.
+    """
+    for batched in (False, True):
+        for nodelay in (False, True):
+            syscalls, p50, p99 = run_frames(batched, nodelay, frames, projectiles)
+            print(f'batched: {batched!s:<5} TCP_NODELAY: {nodelay!s:<5} syscalls/frame: {syscalls:5.2f}, '
+                  f'latency p50: {p50 * 1000:6.3f} ms, p99: {p99 * 1000:6.3f} ms')
+
+
+def simulated_snapshots(ticks: int, players: int = 4):
+    from game import Game
+
+    simulated_time = [0.0]
+    game = Game(game_id=0, clock=lambda: simulated_time[0])
+    for _ in range(players):
+        game.join_new_player('127.0.0.1')
+    snapshots = []
+    for tick in range(ticks):
+        simulated_time[0] = tick * SIMULATED_TICK
+        for _, player in game.players:
+            player.rotate(1)
+            player.forward(player.speed)
+            player.update(True)
+            if tick % 10 == player.id:
+                game.update_projectiles(player.shoot(300, 300))
+        snapshots.append(game.take_snapshot())
+    return snapshots
+
+
+def measure_codec(snapshots, new_codec, per_message: bool):
+    from protocol import HEADER
+
+    encoder, decoder = new_codec(), new_codec()
+    size, start = 0, perf_counter()
+    for snapshot in snapshots:
+        if per_message:
+            encoder, decoder = new_codec(), new_codec()
+        frame = encoder.encode(snapshot)
+        size += len(frame)
+        _, flags = HEADER.unpack_from(frame)
+        decoder.decode(memoryview(frame)[HEADER.size:], flags)
+    return size / len(snapshots), (perf_counter() - start) / len(snapshots)
+
+
+def benchmark_snapshot_compression(ticks: int = 1000):
+    """
+    Average size of the encoded GameSnapshot of a 4 players game and the CPU
+    time of encoding and decoding it, with each MessageCodec setup.
+    """
+    from compression import game_messages_dictionary
+    from protocol import MessageCodec
+
+    snapshots = simulated_snapshots(ticks)
+    dictionary = game_messages_dictionary()
+    setups = {
+        'plain': (lambda: MessageCodec(), False),
+        'zlib, new context per message': (lambda: MessageCodec(True), True),
+        'zlib + dictionary, new context per message': (lambda: MessageCodec(True, dictionary), True),  # shared
+        'zlib, persistent context': (lambda: MessageCodec(True), False),
+        'zlib + dictionary, persistent context': (lambda: MessageCodec(True, dictionary), False),
+    }
+    for name, (new_codec, per_message) in setups.items():
+        size, elapsed = measure_codec(snapshots, new_codec, per_message)
+        print(f'{name:<44} {size:7.1f} B/snapshot, {elapsed * 1e6:7.1f} us/snapshot')
+
+
+def benchmark_snapshot_fan_out(ticks: int = 200):
+    """
+    CPU time per tick of encoding a GameSnapshot for each connection versus
+    encoding it once and sending the same frame to the whole audience. The
+    last case is the default server setup, with compressing connections:
+    snapshot is pickled and compressed once for all of them.
+    """
+    from compression import compressing_codec
+    from protocol import EncodedMessage, PLAIN
+
+    snapshots = simulated_snapshots(ticks)
+    for audience in (1, 4, 16, 64):
+        start = perf_counter()
+        for snapshot in snapshots:
+            for _ in range(audience):
+                PLAIN.encode(snapshot)
+        per_connection = (perf_counter() - start) / ticks
+        start = perf_counter()
+        for snapshot in snapshots:
+            encoded = EncodedMessage(snapshot)
+            for _ in range(audience):
+                PLAIN.encode(encoded)
+        once = (perf_counter() - start) / ticks
+        codecs = [compressing_codec() for _ in range(audience)]
+        start = perf_counter()
+        for snapshot in snapshots:
+            encoded = EncodedMessage(snapshot)
+            for codec in codecs:
+                codec.encode(encoded)
+        compressed = (perf_counter() - start) / ticks
+        print(f'audience: {audience:3d}, encoded per connection: {per_connection * 1e6:8.1f} us/tick, '
+              f'encoded once: {once * 1e6:6.1f} us/tick, encoded and compressed once: {compressed * 1e6:6.1f} us/tick')
+
+
+BENCHMARKS = {
+    'server_startup': benchmark_server_startup,
+    'dictionary_checksum': benchmark_dictionary_checksum,
+    'frame_batching': benchmark_frame_batching,
+    'snapshot_compression': benchmark_snapshot_compression,
+    'snapshot_fan_out': benchmark_snapshot_fan_out,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f'--- {name} ---')
+        BENCHMARKS[name]()
@@ -1,13 +1,18 @@
 #!/usr/bin/env python
+import sys
+
+from time import monotonic
 from typing import List, Tuple, Callable
 
 from arcade import (
     Color, Window, View, SpriteList, SpriteSolidColor, get_sprites_at_point, draw_text, draw_polygon_filled,
     draw_rectangle_outline, is_point_in_polygon, run
 )
-from arcade.key import LSHIFT, W, S, A, D
-from game import Player, Projectile, Map, PLAYERS_COLORS, GREEN
+from arcade.key import LSHIFT, W, S, A, D, F11, F12
+from game import GameSnapshot, MapRequest, ObstacleDiff, ObstacleHit, Player, Projectile, Map, PLAYERS_COLORS, GREEN
 from networking import NetworkClient
+from interpolation import InterpolationBuffer
+from profiling import FrameProfiler, NullProfiler
 from visibility import VisibleArea
 
 WIDTH = 500
@@ -16,6 +21,8 @@ TITLE = 'Pytanks'
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 SCREEN_MOVE_MARGIN = 50
+SEND_RATE = 20  # how many times per second local Player state is sent to the server
+HUD_LINE_HEIGHT = 14
 
 
 class Button(SpriteSolidColor):
@@ -40,8 +47,9 @@ class Button(SpriteSolidColor):
 
 class GameClientWindow(Window):
 
-    def __init__(self, width, height, title):
+    def __init__(self, width, height, title, profile: bool = False):
         super().__init__(width, height, title)
+        self.profiler = FrameProfiler() if profile else NullProfiler()
         self.network_client = NetworkClient()
         self.game_view = None
         self.menu_view = MenuView()
@@ -95,12 +103,17 @@ class GameView(View):
         self.local_player = None
         self.enemy_player = None
         self.players = {}
+        self.interpolation_buffers = {}
+        self.time_since_data_shared = 0
         self.projectiles = set()
+        self.last_projectile_id = 0
         self.map = Map()
+        self.map_requested_at_revision = None
         self.visible_area = VisibleArea()
         self.keys_pressed = set()
         self.screen_text = ''
         self.screen_text_position = 250, 20
+        self.profiler = self.window.profiler
         self.setup_players()
     
     @property
@@ -109,6 +122,7 @@ class GameView(View):
 
     def setup_players(self):
         self.local_player = local_player = self.window.network_client.connect()
+        self.map.load_state(self.window.network_client.take_map_state())
         game_id = local_player.game_id
 
         for i in range(4):
@@ -119,12 +133,22 @@ class GameView(View):
 
     def on_draw(self):
         super().on_draw()
-        self.window.clear(color=BLACK)
-        self.draw_game_objects()
-        draw_text(self.screen_text, *self.screen_text_position, WHITE)
+        with self.profiler.phase('draw'):
+            self.window.clear(color=BLACK)
+            self.draw_game_objects()
+            draw_text(self.screen_text, *self.screen_text_position, WHITE)
+        if self.profiler.enabled:
+            self.draw_profiler_hud()
+        self.profiler.end_frame()
+
+    def draw_profiler_hud(self):
+        left, bottom, _, height = self.viewport
+        top = bottom + height - HUD_LINE_HEIGHT
+        for i, line in enumerate(self.profiler.hud_lines()):
+            draw_text(line, left + 5, top - i * HUD_LINE_HEIGHT, GREEN, font_size=9)
 
     def draw_game_objects(self):
-        for obstacle in self.map.obstacles:
+        for obstacle in self.map.obstacles.values():
             draw_polygon_filled(obstacle.vertices, WHITE)
         for player in (p for p in self.players.values() if p.alive and self.is_object_visible(p)):
             player.draw()
@@ -133,16 +157,26 @@ class GameView(View):
 
     def update(self, delta_time: float):
         super().update(delta_time)
+        profiler = self.profiler
         self.update_screen_text()
         if self.local_player.is_moving:
-            self.update_visible_area()
+            with profiler.phase('visible_area'):
+                self.update_visible_area()
         if self.all_players_in_game:
-            self.update_players()
-            self.update_projectiles()
+            with profiler.phase('players'):
+                self.update_players()
+            with profiler.phase('projectiles'):
+                self.update_projectiles()
             self.local_player.aim_at_the_cursor_position(*self.mouse_position)
         if self.local_player.active:
             self.process_keyboard_input()
-            self.share_data_with_server()
+        self.time_since_data_shared += delta_time
+        if self.local_player.active and self.time_since_data_shared >= 1 / SEND_RATE:
+            self.time_since_data_shared = 0
+            with profiler.phase('network'):
+                self.share_data_with_server()
+        with profiler.phase('interpolation'):
+            self.interpolate_remote_players()
 
     def update_screen_text(self):
         left, bottom, *_ = self.viewport
@@ -156,6 +190,19 @@ class GameView(View):
                 player.update(player == self.local_player)
             else:
                 del self.players[player.id]
+                self.interpolation_buffers.pop(player.id, None)
+
+    def interpolate_remote_players(self):
+        now = monotonic()
+        for player_id, buffer in self.interpolation_buffers.items():
+            if (player := self.players.get(player_id)) is not None and (state := buffer.sample(now)) is not None:
+                (x, y), (new_x, new_y) = player.position, state[0]
+                player.position, player.angle = state
+                weapon = player.weapon
+                weapon.start = player.position
+                # weapon end was computed for the newest received position, so it is moved along with the tank
+                weapon.end = weapon.end[0] + new_x - x, weapon.end[1] + new_y - y
+                player.update_polygon()
 
     def update_projectiles(self):
         for projectile in self.projectiles.copy():
@@ -181,11 +228,36 @@ class GameView(View):
                 player.rotate(-1)
 
     def share_data_with_server(self):
-        enemies, projectiles = self.window.network_client.send(self.local_player)
-        if enemies is not None:
-            self.players.update({enemy.id: enemy for enemy in enemies})
-        if projectiles is not None:
-            self.projectiles.update(projectiles)
+        network_client = self.window.network_client
+        if (snapshot := network_client.send(self.local_player)) is not None:
+            if (map_state := network_client.take_map_state()) is not None:
+                self.map.load_state(map_state)
+                self.update_visible_area()
+            self.apply_snapshot(snapshot)
+
+    def apply_snapshot(self, snapshot: GameSnapshot):
+        now = monotonic()
+        for player in snapshot.players:
+            if player.id != self.local_player.id and player.id in self.players:
+                self.players[player.id] = player
+                buffer = self.interpolation_buffers.setdefault(player.id, InterpolationBuffer())
+                buffer.push(now, player)
+        for diff in snapshot.obstacle_diffs:
+            self.apply_obstacle_diff(diff)
+        if snapshot.map_revision > self.map.revision and self.map_requested_at_revision != self.map.revision:
+            # some diffs were missed, or are not sent anymore, so whole map has to be requested
+            self.map_requested_at_revision = self.map.revision
+            self.window.network_client.send(MapRequest(self.map.revision))
+        for projectile in snapshot.projectiles:
+            if projectile.unique_id > self.last_projectile_id:
+                self.last_projectile_id = projectile.unique_id
+                if projectile.player_id != self.local_player.id:
+                    self.projectiles.add(projectile)
+
+    def apply_obstacle_diff(self, diff: ObstacleDiff):
+        if diff.revision == self.map.revision + 1:
+            parts = self.map.apply_obstacle_diff(diff)
+            self.visible_area.replace_obstacle(diff.obstacle_id, parts)
 
     def on_mouse_press(self, x: float, y: float, button: int, modifiers: int):
         if self.local_player.alive:
@@ -200,6 +272,15 @@ class GameView(View):
 
     def on_key_press(self, symbol: int, modifiers: int):
         self.keys_pressed.add(symbol)
+        if self.profiler.enabled:
+            self.process_profiler_keys(symbol)
+
+    def process_profiler_keys(self, symbol: int):
+        if symbol == F11:
+            if (file_name := self.profiler.toggle_capture()) is not None:
+                print(f'cProfile and tracemalloc capture saved to: {file_name}.*')
+        elif symbol == F12:
+            print(f'Frame times percentiles saved to: {self.profiler.dump()}')
 
     def on_key_release(self, symbol: int, modifiers: int):
         self.keys_pressed.discard(symbol)
@@ -234,8 +315,9 @@ class GameView(View):
     def check_for_collisions_with_obstacles(self, projectile, x, y):
         for obstacle in self.map.visible_obstacles:
             if is_point_in_polygon(x, y, obstacle):
-                if obstacle.destructible:
-                    obstacle.damage(x, y)
+                if obstacle.destructible and projectile.player_id == self.local_player.id:
+                    # shooter's client reports the hit, server cuts the obstacle and sends diff to everyone
+                    self.window.network_client.send(ObstacleHit(obstacle.id, x, y))
                 projectile.kill()
 
     def check_for_collisions_with_players(self, projectile, x, y):
@@ -247,5 +329,5 @@ class GameView(View):
 
 
 if __name__ == '__main__':
-    client = GameClientWindow(WIDTH, HEIGHT, TITLE)
+    client = GameClientWindow(WIDTH, HEIGHT, TITLE, profile='--profile' in sys.argv)
     run()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+from functools import lru_cache
+from pickle import dumps
+from zlib import crc32
+
+from game import Game, PLAYERS_COLORS
+from protocol import MessageCodec
+
+
+@lru_cache(maxsize=None)
+def game_messages_dictionary() -> bytes:
+    """
+    Preset zlib dictionary made of the typical messages of a full Game: a
+    client batch with Projectiles and a Player, and a GameSnapshot. It is
+    built the same way by the client and the server, so they do not need to
+    exchange it, only to compare its checksum. Game gets a fixed clock, since
+    time of spawning projectiles is pickled too.
+    """
+    game = Game(game_id=0, clock=lambda: 0.0)
+    for _ in PLAYERS_COLORS:
+        game.join_new_player('127.0.0.1')
+    player = game.last_added_player()
+    batch = tuple(player.shoot(300, 300) for _ in range(2)) + (player,)
+    for projectile in batch[:-1]:
+        game.update_projectiles(projectile)
+    # zlib matches the most recent part of the dictionary best, so the most frequent message goes last
+    return dumps(batch) + dumps(game.take_snapshot())
+
+
+def dictionary_checksum() -> int:
+    return crc32(game_messages_dictionary())
+
+
+def compressing_codec() -> MessageCodec:
+    return MessageCodec(compression=True, dictionary=game_messages_dictionary())
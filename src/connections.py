@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+from collections import deque
+from socket import socket, SHUT_RDWR
+from threading import Thread, Condition
+from typing import Any, Deque, Tuple
+
+from protocol import MessageCodec, send_message
+from simple_logging import log
+
+SEND_QUEUE_SIZE = 8
+MAX_DROPPED_SNAPSHOTS = 30  # client which could not receive that many snapshots in a row is evicted
+
+
+class ConnectionWriter(Thread):
+    """
+    Sends messages to one connection from its own thread, so a slow client
+    blocks only this writer, never the thread reading its messages, nor the
+    GameWorker publishing snapshots.
+
+    The queue is bounded. Snapshots are 'latest wins': a new one replaces a
+    snapshot still waiting in the queue, since it is stale anyway. Client
+    which keeps the queue full, or makes writer drop snapshots again and
+    again, or does not accept data within the socket timeout, is evicted by
+    shutting its connection down, which ends the reading thread too.
+    """
+
+    def __init__(self, connection: socket, codec: MessageCodec, address: str,
+                 max_queued: int = SEND_QUEUE_SIZE, max_dropped: int = MAX_DROPPED_SNAPSHOTS):
+        super().__init__(name=f'writer-{address}', daemon=True)
+        self.connection = connection
+        self.codec = codec
+        self.address = address
+        self.max_queued = max_queued
+        self.max_dropped = max_dropped
+        self.queue: Deque[Tuple[Any, bool]] = deque()
+        self.condition = Condition()
+        self.closed = False
+        self.dropped_in_row = 0
+
+    def send(self, message: Any, latest_wins: bool = False):
+        with self.condition:
+            if self.closed:
+                return
+            if latest_wins and self.queue and self.queue[-1][1]:
+                self.queue[-1] = message, latest_wins
+                self.dropped_in_row += 1
+                if self.dropped_in_row > self.max_dropped:
+                    return self.evict(f'{self.dropped_in_row} snapshots dropped in a row')
+            elif len(self.queue) >= self.max_queued:
+                return self.evict('send queue is full')
+            else:
+                self.queue.append((message, latest_wins))
+            self.condition.notify()
+
+    def send_snapshot(self, encoded_snapshot: Any):
+        self.send(encoded_snapshot, latest_wins=True)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closed)
+                if self.closed:
+                    break
+                message, latest_wins = self.queue.popleft()
+                if latest_wins:
+                    self.dropped_in_row = 0
+            try:
+                send_message(self.connection, message, self.codec)
+            except OSError as e:  # timeouts included
+                self.evict(f'sending failed: {e}')
+                break
+
+    def evict(self, reason: str):
+        with self.condition:
+            if self.closed:
+                return
+            log(f'Evicting {self.address}: {reason}')
+            self.close()
+        try:
+            self.connection.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.condition:  # Condition uses RLock, so it could be acquired again by the same thread
+            self.closed = True
+            self.queue.clear()
+            self.condition.notify_all()
@@ -2,13 +2,11 @@
 from __future__ import annotations
 import math
 
-import arcade
+from copy import copy
+from time import monotonic
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 
-from typing import List, Tuple
-
-from arcade import is_point_in_polygon
-
-from geometry import move_along_vector, calculate_angle
+from geometry import move_along_vector, calculate_angle, is_point_in_polygon, rotate_point, PRECISION
 
 GREEN = (0, 255, 0)
 RED = (255, 0, 0)
@@ -16,6 +14,14 @@ BLUE = (0, 0, 255)
 GREY = (0, 200, 200)
 YELLOW = (255, 255, 0)
 PLAYERS_COLORS = [RED, GREEN, BLUE, YELLOW]
+PROJECTILE_LIFETIME = 0.5  # seconds projectile is sent in snapshots, a bit longer than its flight takes
+SNAPSHOT_PROJECTILES = 64  # upper limit of projectiles in GameSnapshot, in case of a shooting spree
+OBSTACLE_DIFF_LIFETIME = 1.0  # seconds ObstacleDiff is sent in snapshots, clients missing it request MapState
+SNAPSHOT_OBSTACLE_DIFFS = 16  # upper limit of ObstacleDiffs in GameSnapshot
+OBSTACLE_DAMAGE_RADIUS = 8
+OBSTACLE_DAMAGE_RESOLUTION = 4  # segments of the damage circle per its quarter
+MIN_OBSTACLE_AREA = 4  # smaller parts of the damaged obstacles disappear
+MAP_GRID_CELL_SIZE = 100
 
 
 class GameObject:
@@ -105,14 +111,14 @@ class Player(GameObject):
         cx, cy = self.position
         w, h = self.size
         self._polygon = [
-            arcade.rotate_point(p[0], p[1], cx, cy, self.angle) for p in [
+            rotate_point(p[0], p[1], cx, cy, self.angle) for p in [
                 (cx - w / 2, cy - h / 2), (cx + w, cy - h / 2), (cx + w, cy + h / 2), (cx - w, cy + h / 2)
             ]
         ]
 
     def draw(self):
-        arcade.draw_rectangle_filled(*self.position, *self.size, self.color, -self.angle)
-        self.weapon.draw()
+        from rendering import draw_player
+        draw_player(self)
 
     def shoot(self, x, y) -> Projectile:
         return self.weapon.shoot(self, x, y)
@@ -139,8 +145,8 @@ class Weapon:
         self.end = move_along_vector(self.start, 10 + self.damage, (x, y))
 
     def draw(self):
-        arcade.draw_circle_filled(*self.start, radius=8, color=(255, 255, 255))
-        arcade.draw_line(*self.start, *self.end, color=(255, 255, 255), line_width=3)
+        from rendering import draw_weapon
+        draw_weapon(self)
 
     def shoot(self, shooter, x, y) -> Projectile:
         angle = calculate_angle(*self.start, x, y)
@@ -151,6 +157,7 @@ class Projectile(GameObject):
     def __init__(self, player: Player, position: Tuple[float, float], angle: float, speed: float, damage: float):
         super().__init__()
         self.unique_id = None
+        self.spawned_at = None
         self.player_id = player.id
         self.color = player.color
         self.size = 3
@@ -160,7 +167,6 @@ class Projectile(GameObject):
         self.distance = 0
         self.damage = damage
         self.active = True
-        self.known = 1  # since local client creates this instance and need no update about it's creation
         self.forward(self.speed)
 
     def __eq__(self, other: Projectile) -> bool:
@@ -176,7 +182,8 @@ class Projectile(GameObject):
             self.active = False
 
     def draw(self):
-        arcade.draw_point(*self.position, self.color, self.size)
+        from rendering import draw_projectile
+        draw_projectile(self)
 
     def kill(self):
         self.active = False
@@ -187,10 +194,44 @@ class PowerUp:
         self.type = power_up_type
 
 
+def shapely_geometry():
+    # imported only when Map with destructible obstacles is created, to keep server startup light
+    from shapely import geometry
+    return geometry
+
+
+class ObstacleHit(NamedTuple):
+    obstacle_id: int
+    x: float
+    y: float
+
+
+class ObstacleDiff(NamedTuple):
+    """
+    Change of the Map geometry: obstacle 'obstacle_id' was replaced with the
+    'parts' - pairs of new obstacle id and vertices. Empty 'parts' means that
+    obstacle was destroyed completely.
+    """
+    revision: int
+    obstacle_id: int
+    parts: Tuple[Tuple[int, Tuple[Tuple[float, float], ...]], ...]
+
+
+class MapState(NamedTuple):
+    revision: int
+    obstacles: Tuple[Tuple[int, Tuple[Tuple[float, float], ...], bool], ...]
+
+
+class MapRequest(NamedTuple):
+    revision: int
+
+
 class Obstacle:
-    def __init__(self, vertices: List[Tuple], destructible: bool = False):
+    def __init__(self, vertices: List[Tuple], destructible: bool = False, obstacle_id: int = None):
+        self.id = obstacle_id
         self.vertices = vertices
         self.destructible = destructible
+        self.walls = [(vertices[i - 1], vertices[i]) for i in range(len(vertices))]
 
     def __len__(self):
         return len(self.vertices)
@@ -201,19 +242,57 @@ class Obstacle:
     def __iter__(self):
         return iter(self.vertices)
 
-    def damage(self, x: float, y: float):
-        # TODO: damage obstacle polygon in position where Projectile hit
-        print(f'Obstacle was hit at: {x, y}')
+    @property
+    def bounding_box(self) -> Tuple[float, float, float, float]:
+        return bounding_box(self.vertices)
+
+    def damage(self, x: float, y: float, radius: float = OBSTACLE_DAMAGE_RADIUS) -> List[List[Tuple]]:
+        """
+        Cut circle of 'radius' around the (x, y) point out of the obstacle.
+        Circle lying entirely inside the obstacle would only make a hole in
+        it, and holes are not kept, so such circle is moved to the nearest
+        point of the obstacle edge, where projectile has entered it.
+
+        :return: List -- vertices of each part of the obstacle which is left
+        """
+        geometry = shapely_geometry()
+        polygon, center = geometry.Polygon(self.vertices), geometry.Point(x, y)
+        if polygon.contains(center) and polygon.exterior.distance(center) >= radius:
+            center = polygon.exterior.interpolate(polygon.exterior.project(center))
+        left = polygon.difference(center.buffer(radius, OBSTACLE_DAMAGE_RESOLUTION))
+        return [
+            [(round(px, PRECISION), round(py, PRECISION)) for (px, py) in part.exterior.coords[:-1]]
+            for part in getattr(left, 'geoms', [left])
+            if part.geom_type == 'Polygon' and part.area >= MIN_OBSTACLE_AREA
+        ]
 
 
 class Map:
+    """
+    Obstacles are kept by their ids and indexed in a uniform grid of cells,
+    so finding obstacles in the viewport checks only obstacles from the
+    cells it covers, and damaging an obstacle re-indexes only that obstacle.
+    """
+
     def __init__(self, map_name: str = None):
         self.id = 0
-        self.obstacles = self.generate_random_obstacles() if map_name is None else self.load_obstacles_map(map_name)
+        self.revision = 0
+        self.obstacles: Dict[int, Obstacle] = {}
+        self.grid: Dict[Tuple[int, int], Set[int]] = {}
+        self.next_obstacle_id = 0
+        obstacles = self.generate_random_obstacles() if map_name is None else self.load_obstacles_map(map_name)
+        for obstacle in obstacles:
+            self.add_obstacle(obstacle.vertices, obstacle.destructible)
+        if any(obstacle.destructible for obstacle in obstacles):
+            shapely_geometry()  # pay for the import now, not when the first obstacle is hit during the game
         self._visible = []
 
     def update_visible_map_area(self, viewport: List[Tuple]):
-        self._visible = [o for o in self.obstacles if any(is_point_in_polygon(p[0], p[1], viewport) for p in o)]
+        candidates = {o for cell in self.grid_cells(*bounding_box(viewport)) for o in self.grid.get(cell, ())}
+        self._visible = [
+            o for o in (self.obstacles[i] for i in sorted(candidates))
+            if any(is_point_in_polygon(p[0], p[1], viewport) for p in o)
+        ]
 
     @property
     def visible_obstacles(self) -> List[Obstacle]:
@@ -221,23 +300,96 @@ class Map:
 
     def generate_random_obstacles(self) -> List[Obstacle]:
         # TODO
-        return [Obstacle(vertices=[(300, 300), (500, 300), (500, 310), (300, 310)])]
+        return [
+            Obstacle(vertices=[(300, 300), (500, 300), (500, 310), (300, 310)]),
+            Obstacle(vertices=[(100, 400), (200, 400), (200, 420), (100, 420)], destructible=True)
+        ]
 
     def load_obstacles_map(self, map_name: str) -> List[Obstacle]:
         # TODO
         return [Obstacle(vertices=[(300, 300), (500, 300), (500, 310), (300, 310)])]
 
+    @staticmethod
+    def grid_cells(left: float, bottom: float, right: float, top: float):
+        for column in range(int(left // MAP_GRID_CELL_SIZE), int(right // MAP_GRID_CELL_SIZE) + 1):
+            for row in range(int(bottom // MAP_GRID_CELL_SIZE), int(top // MAP_GRID_CELL_SIZE) + 1):
+                yield column, row
+
+    def add_obstacle(self, vertices: List[Tuple], destructible: bool, obstacle_id: int = None) -> Obstacle:
+        if obstacle_id is None:
+            obstacle_id = self.next_obstacle_id
+        self.next_obstacle_id = max(self.next_obstacle_id, obstacle_id + 1)
+        self.obstacles[obstacle_id] = obstacle = Obstacle(vertices, destructible, obstacle_id)
+        for cell in self.grid_cells(*obstacle.bounding_box):
+            self.grid.setdefault(cell, set()).add(obstacle_id)
+        return obstacle
+
+    def remove_obstacle(self, obstacle_id: int):
+        obstacle = self.obstacles.pop(obstacle_id)
+        for cell in self.grid_cells(*obstacle.bounding_box):
+            self.grid[cell].discard(obstacle_id)
+
+    def damage_obstacle(self, hit: ObstacleHit) -> Optional[ObstacleDiff]:
+        if (obstacle := self.obstacles.get(hit.obstacle_id)) is None or not obstacle.destructible:
+            return None
+        parts = obstacle.damage(hit.x, hit.y)
+        if len(parts) == 1 and len(parts[0]) == len(obstacle) and set(parts[0]) == set(obstacle):
+            return None  # projectile passed by, nothing was cut off
+        ids = [obstacle.id] + list(range(self.next_obstacle_id, self.next_obstacle_id + len(parts) - 1))
+        diff = ObstacleDiff(self.revision + 1, obstacle.id, tuple((i, tuple(p)) for i, p in zip(ids, parts)))
+        self.apply_obstacle_diff(diff)
+        return diff
+
+    def apply_obstacle_diff(self, diff: ObstacleDiff) -> List[Obstacle]:
+        """Replace damaged obstacle with its parts and return these parts."""
+        self.remove_obstacle(diff.obstacle_id)
+        parts = [self.add_obstacle(list(vertices), True, obstacle_id) for obstacle_id, vertices in diff.parts]
+        self.revision = diff.revision
+        if any(o.id == diff.obstacle_id for o in self._visible):
+            self._visible = [o for o in self._visible if o.id != diff.obstacle_id] + parts
+        return parts
+
+    def get_state(self) -> MapState:
+        return MapState(self.revision, tuple((o.id, tuple(o), o.destructible) for o in self.obstacles.values()))
+
+    def load_state(self, state: MapState):
+        self.obstacles.clear()
+        self.grid.clear()
+        self.next_obstacle_id = 0
+        for obstacle_id, vertices, destructible in state.obstacles:
+            self.add_obstacle(list(vertices), destructible, obstacle_id)
+        self.revision = state.revision
+        self._visible = []
+
+
+def bounding_box(polygon: List[Tuple]) -> Tuple[float, float, float, float]:
+    xs, ys = [v[0] for v in polygon], [v[1] for v in polygon]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+class GameSnapshot(NamedTuple):
+    tick: int
+    players: Tuple[Player, ...]
+    projectiles: Tuple[Projectile, ...]
+    obstacle_diffs: Tuple[ObstacleDiff, ...]
+    map_revision: int
+
 
 class Game:
     projectiles_count = 0
 
-    def __init__(self, game_id: int, name: str = None, max_players: int = 4):
+    def __init__(self, game_id: int, name: str = None, max_players: int = 4, clock: Callable[[], float] = monotonic):
         self.public = bool(name)
         self.id = game_id
         self.name = name or f'Public game, id: {id}'
         self.max_players = max_players
         self.players: List[Tuple[str, Player]] = []
+        self.left_players: Set[int] = set()
         self.projectiles: List[Projectile] = []
+        self.map = Map()
+        self.obstacle_diffs: List[Tuple[float, ObstacleDiff]] = []  # with the time of damage
+        self.tick = 0
+        self.clock = clock
 
     def __contains__(self, item: Player):
         return any(p.id == item.id for (ip, p) in self.players)
@@ -264,24 +416,51 @@ class Game:
         player_ip_address = self.players[player.id][0]
         self.players[player.id] = player_ip_address, player
 
-    def get_other_players_and_projectiles(self, player: Player) -> Tuple[Tuple[Player], Tuple[Projectile]]:
-        return self.get_other_players(player), tuple(self.get_other_players_projectiles())
+    def remove_player(self, player_id: int) -> bool:
+        """
+        Kill Player of the disconnected client, so the other players do not
+        wait for it.
 
-    def get_other_players(self, player: Player) -> Tuple[Player]:
-        # noinspection PyTypeChecker
-        return tuple(other for (ip, other) in self.players if other.id != player.id)
+        :return: bool -- True if all players have left the Game
+        """
+        player_ip_address, player = self.players[player_id]
+        if player.alive:
+            player = copy(player)  # published snapshots still refer to the old instance
+            player.kill()
+            self.players[player_id] = player_ip_address, player
+        self.left_players.add(player_id)
+        return len(self.left_players) == len(self.players)
 
     def update_projectiles(self, projectile: Projectile):
         self.projectiles_count += 1
         projectile.unique_id = self.projectiles_count
+        projectile.spawned_at = self.clock()
         self.projectiles.append(projectile)
 
-    def get_other_players_projectiles(self) -> List[Projectile]:
-        send_projectiles = []
-        for projectile in self.projectiles[::]:
-            if projectile.known < self.max_players:
-                projectile.known += 1
-                send_projectiles.append(projectile)
-            else:
-                self.projectiles.remove(projectile)
-        return send_projectiles
+    def damage_obstacle(self, hit: ObstacleHit):
+        if (diff := self.map.damage_obstacle(hit)) is not None:
+            self.obstacle_diffs.append((self.clock(), diff))
+
+    def take_snapshot(self) -> GameSnapshot:
+        """
+        Return immutable state of the Game which could be read by any thread.
+        Projectiles get monotonically growing unique_ids, so client recognizes
+        the ones it already received in previous snapshots by that id. Each
+        projectile is sent only for PROJECTILE_LIFETIME, long enough for every
+        client to receive it at least once, and each ObstacleDiff only for
+        OBSTACLE_DIFF_LIFETIME.
+        """
+        self.tick += 1
+        now = self.clock()
+        expired = now - PROJECTILE_LIFETIME
+        self.projectiles = [p for p in self.projectiles[-SNAPSHOT_PROJECTILES:] if p.spawned_at > expired]
+        expired = now - OBSTACLE_DIFF_LIFETIME
+        self.obstacle_diffs = [(t, d) for (t, d) in self.obstacle_diffs[-SNAPSHOT_OBSTACLE_DIFFS:] if t > expired]
+        # noinspection PyTypeChecker
+        return GameSnapshot(
+            self.tick,
+            tuple(p for (ip, p) in self.players),
+            tuple(self.projectiles),
+            tuple(d for (t, d) in self.obstacle_diffs),
+            self.map.revision
+        )
@@ -2,7 +2,9 @@
 
 import math
 
-from typing import Tuple
+from typing import List, Sequence, Tuple
+
+PRECISION = 2
 
 
 def move_along_vector(start: Tuple, velocity: float, target: Tuple = None) -> Tuple:
@@ -39,3 +41,32 @@ def calculate_angle(sx: float, sy: float, ex: float, ey: float) -> float:
 def vector_2d(angle: float, scalar: float) -> Tuple:
     rad = -math.radians(angle)
     return math.sin(rad) * scalar, math.cos(rad) * scalar
+
+
+def rotate_point(x: float, y: float, cx: float, cy: float, angle: float) -> List[float]:
+    """
+    Rotate point (x, y) around the (cx, cy) center by 'angle' degrees
+    counter-clockwise.
+    """
+    rad = math.radians(angle)
+    cos_angle, sin_angle = math.cos(rad), math.sin(rad)
+    dx, dy = x - cx, y - cy
+    return [
+        round(cx + dx * cos_angle - dy * sin_angle, PRECISION),
+        round(cy + dx * sin_angle + dy * cos_angle, PRECISION)
+    ]
+
+
+def is_point_in_polygon(x: float, y: float, polygon: Sequence[Tuple]) -> bool:
+    """
+    Check if point lies inside polygon using the even-odd ray casting rule.
+    """
+    inside = False
+    if len(polygon) < 3:
+        return inside
+    ax, ay = polygon[-1]
+    for bx, by in polygon:
+        if (by > y) != (ay > y) and x < (ax - bx) * (y - by) / (ay - by) + bx:
+            inside = not inside
+        ax, ay = bx, by
+    return inside
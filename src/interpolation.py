@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+from __future__ import annotations
+
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from game import Player
+
+INTERPOLATION_DELAY = 0.1  # seconds remote players are rendered behind the newest server state
+INTERPOLATION_BUFFER_SIZE = 32
+
+
+class InterpolationBuffer:
+    """
+    Keeps timestamped states of a remote Player and returns its position and
+    angle for a moment 'delay' seconds in the past, interpolated between the
+    two received states surrounding that moment.
+    """
+
+    def __init__(self, delay: float = INTERPOLATION_DELAY, size: int = INTERPOLATION_BUFFER_SIZE):
+        self.delay = delay
+        self.states: Deque[Tuple[float, Tuple[float, float], float]] = deque(maxlen=size)
+
+    def push(self, timestamp: float, player: Player):
+        self.states.append((timestamp, player.position, player.angle))
+
+    def sample(self, now: float) -> Optional[Tuple[Tuple[float, float], float]]:
+        if not (states := self.states):
+            return None
+        render_time = now - self.delay
+        while len(states) > 2 and states[1][0] <= render_time:
+            states.popleft()
+        t0, p0, a0 = states[0]
+        if len(states) == 1 or render_time <= t0:
+            return p0, a0
+        t1, p1, a1 = states[1]
+        if render_time >= t1:
+            return p1, a1
+        f = (render_time - t0) / (t1 - t0)
+        position = p0[0] + (p1[0] - p0[0]) * f, p0[1] + (p1[1] - p0[1]) * f
+        return position, a0 + ((a1 - a0 + 180) % 360 - 180) * f
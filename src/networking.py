@@ -1,53 +1,101 @@
 #!/usr/bin/env python
-from socket import socket, AF_INET, SOCK_STREAM, gethostname, gethostbyname, error as socket_error
+from socket import (
+    socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY, gethostname, gethostbyname, error as socket_error
+)
 
-from pickle import dumps, loads
-from typing import Tuple
-
-from game import Player, Projectile
+from compression import compressing_codec, dictionary_checksum
+from game import GameSnapshot, MapRequest, MapState, ObstacleHit, Player, Projectile
+from protocol import MessageReceiver, send_message, PLAIN
 
 from functools import singledispatchmethod
+from typing import Optional
 
 
 class NetworkClient:
-    def __init__(self):
+    def __init__(self, compression: bool = True):
         self.data = None
+        self.compression = compression
+        self.codec = PLAIN
         self.client_ip_address = gethostbyname(gethostname())
         self.socket = socket(AF_INET, SOCK_STREAM)
+        self.socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
         self.server_name = '127.0.1.1'
         self.port = 5555
         self.address = (self.client_ip_address, self.port)
+        self.receiver = MessageReceiver(self.socket)
+        self.outgoing = []
+        self.map_state: Optional[MapState] = None
 
     def connect(self, game_name: str = None, max_players: int = 4) -> Player:
         try:
             self.socket.connect(self.address)
-            self.socket.send(dumps({'game_name': game_name, 'max_players': max_players}))
-            return loads(self.socket.recv(2048))
+            checksum = dictionary_checksum() if self.compression else None
+            send_message(self.socket, {'game_name': game_name, 'max_players': max_players, 'compression': checksum})
+            response = self.receive_handshake_response()
+            if response['compression']:
+                self.codec = self.receiver.codec = compressing_codec()
+            self.map_state = response['map']
+            return response['player']
         except socket_error as e:
             raise e
 
+    def spectate(self, game_name: str = None) -> Optional[str]:
+        """
+        Connect as a read-only spectator of the game named 'game_name', or of
+        any game, if no name is given. Return name of the spectated game, or
+        None if there is no game to spectate. Use receive_snapshot() after.
+        """
+        self.socket.connect(self.address)
+        checksum = dictionary_checksum() if self.compression else None
+        send_message(self.socket, {'spectate': game_name, 'compression': checksum})
+        response = self.receive_handshake_response()
+        if response['compression']:
+            self.receiver.codec = compressing_codec()
+        self.map_state = response['map']
+        return response['game']
+
+    def receive_handshake_response(self) -> dict:
+        if 'rejected' in (response := self.receiver.receive()):
+            self.socket.close()
+            raise ConnectionRefusedError(response['rejected'])
+        return response
+
+    def receive_snapshot(self) -> GameSnapshot:
+        return self.receiver.receive()
+
     @singledispatchmethod
     def send(self, game_object):
         pass
 
     @send.register
-    def _(self, game_object: Player) -> Tuple[Tuple[Player], Tuple[Projectile]]:
+    def _(self, game_object: Player) -> GameSnapshot:
+        self.outgoing.append(game_object)
+        return self.flush()
+
+    @send.register(Projectile)
+    @send.register(ObstacleHit)
+    @send.register(MapRequest)
+    def _(self, game_object):
+        # these wait for the next Player update, to be sent with it in one message
+        self.outgoing.append(game_object)
+
+    def take_map_state(self) -> Optional[MapState]:
+        map_state, self.map_state = self.map_state, None
+        return map_state
+
+    def flush(self) -> GameSnapshot:
+        batch, self.outgoing = tuple(self.outgoing), []
         try:
-            self.socket.send(dumps(game_object))
+            send_message(self.socket, batch, self.codec)
             try:
-                return loads(self.socket.recv(2048))
+                while isinstance(received := self.receiver.receive(), MapState):
+                    self.map_state = received
+                return received
             except Exception as e:
                 print(e)
         except socket_error as se:
             print(se)
 
-    @send.register
-    def _(self, game_object: Projectile):
-        try:
-            self.socket.send(dumps(game_object))
-        except socket_error as se:
-            print(se)
-
     def disconnect(self, player: Player):
         player.kill()
         self.send(player)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+import cProfile
+import tracemalloc
+
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, strftime
+from typing import Deque, Dict, List, Optional
+
+PROFILED_FRAMES = 600
+PERCENTILES = (50, 95, 99)
+HUD_REFRESH_FRAMES = 30
+TRACEMALLOC_TOP_LINES = 30
+FRAME = 'frame'
+
+
+class FrameProfiler:
+    """
+    Records how much time each named phase of the frame took. Timings of the
+    last 'frames' frames are kept in a ring buffer, so they could be shown in
+    HUD, or dumped as percentiles. Optionally captures cProfile and
+    tracemalloc data between start_capture() and stop_capture() calls.
+    """
+    enabled = True
+
+    def __init__(self, frames: int = PROFILED_FRAMES):
+        self.frames: Deque[Dict[str, float]] = deque(maxlen=frames)
+        self.current: Dict[str, float] = {}
+        self.last_frame_end = perf_counter()
+        self.frames_count = 0
+        self.profile: Optional[cProfile.Profile] = None
+        self.hud_statistics: Dict[str, Dict[int, float]] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.current[name] = self.current.get(name, 0) + perf_counter() - start
+
+    def end_frame(self):
+        now = perf_counter()
+        self.current[FRAME] = now - self.last_frame_end
+        self.frames.append(self.current)
+        self.frames_count += 1
+        self.current, self.last_frame_end = {}, now
+
+    def percentiles(self) -> Dict[str, Dict[int, float]]:
+        timings: Dict[str, List[float]] = {}
+        for frame in self.frames:
+            for name, elapsed in frame.items():
+                timings.setdefault(name, []).append(elapsed)
+        return {name: {p: percentile(values, p) for p in PERCENTILES} for name, values in timings.items()}
+
+    def hud_lines(self) -> List[str]:
+        if not self.frames:
+            return []
+        if not self.hud_statistics or self.frames_count % HUD_REFRESH_FRAMES == 0:
+            self.hud_statistics = self.percentiles()  # sorting all timings each frame would distort them
+        last = self.frames[-1]
+        return [
+            f'{name}: {last.get(name, 0) * 1000:5.1f} ms (p95: {stats[95] * 1000:5.1f} ms)'
+            for name, stats in self.hud_statistics.items()
+        ]
+
+    def dump(self, file_name: str = None) -> str:
+        file_name = file_name or f'frame-times-{strftime("%Y%m%d-%H%M%S")}.txt'
+        with open(file_name, 'w') as file:
+            print(f'Percentiles of the last {len(self.frames)} frames, in milliseconds:', file=file)
+            for name, stats in self.percentiles().items():
+                values = ', '.join(f'p{p}: {elapsed * 1000:.3f}' for p, elapsed in stats.items())
+                print(f'{name}: {values}', file=file)
+        return file_name
+
+    @property
+    def capturing(self) -> bool:
+        return self.profile is not None
+
+    def start_capture(self):
+        self.profile = cProfile.Profile()
+        tracemalloc.start()
+        self.profile.enable()
+
+    def stop_capture(self, file_name: str = None) -> str:
+        self.profile.disable()
+        file_name = file_name or f'capture-{strftime("%Y%m%d-%H%M%S")}'
+        self.profile.dump_stats(f'{file_name}.prof')
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        tracemalloc.stop()
+        with open(f'{file_name}.tracemalloc.txt', 'w') as file:
+            for line in statistics[:TRACEMALLOC_TOP_LINES]:
+                print(line, file=file)
+        self.profile = None
+        return file_name
+
+    def toggle_capture(self) -> Optional[str]:
+        if self.capturing:
+            return self.stop_capture()
+        self.start_capture()
+
+
+class NullProfiler(FrameProfiler):
+    """Used when profiling is off, so instrumented code costs almost nothing."""
+    enabled = False
+
+    def phase(self, name: str):
+        return nullcontext()
+
+    def end_frame(self):
+        pass
+
+
+def percentile(values: List[float], p: int) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+from pickle import dumps, loads
+from struct import Struct
+from socket import socket
+from typing import Any
+from zlib import compressobj, decompressobj, Z_SYNC_FLUSH
+
+HEADER = Struct('!IB')  # payload length and flags
+COMPRESSED = 1  # compressed in the zlib stream of the connection
+COMPRESSED_ALONE = 2  # compressed on its own, with the preset dictionary only
+RECEIVE_BUFFER_SIZE = 4096
+COMPRESSION_LEVEL = 6
+COMPRESSION_THRESHOLD = 128  # smaller payloads are not worth compressing
+
+
+class EncodedMessage:
+    """
+    Message pickled once, to be sent to many connections. Its plain frame is
+    prepared up front, so connections without compression send the very
+    same bytes object. Compressed frame is made when the first compressing
+    connection needs it, independently of any connection's zlib stream, so
+    all the other compressing connections send the same bytes too.
+    """
+    __slots__ = ('payload', 'frame', 'compressed')
+
+    def __init__(self, message: Any):
+        self.payload = dumps(message)
+        self.frame = HEADER.pack(len(self.payload), 0) + self.payload
+        self.compressed = None
+
+    def compressed_frame(self, dictionary: bytes = None) -> bytes:
+        if self.compressed is None:  # writers racing here would compute the same bytes
+            compressor = compressobj(COMPRESSION_LEVEL, **zlib_dictionary(dictionary))
+            payload = compressor.compress(self.payload) + compressor.flush()
+            self.compressed = HEADER.pack(len(payload), COMPRESSED_ALONE) + payload
+        return self.compressed
+
+
+def zlib_dictionary(dictionary: bytes = None) -> dict:
+    return {'zdict': dictionary} if dictionary else {}
+
+
+class MessageCodec:
+    """
+    Turns messages into payloads of the frames and back. Plain codec only
+    pickles messages. Compressing codec keeps one zlib stream per direction
+    of the connection for its whole life, so each message is compressed with
+    the previous ones as a context, which is what makes small, repetitive
+    game messages compressible. Preset 'dictionary' gives such a context to
+    the first messages. Both sides of the connection must use the same one.
+    EncodedMessages, shared by many connections, are compressed out of the
+    stream, with the preset dictionary only, so their cost does not grow
+    with the number of connections.
+    """
+
+    def __init__(self, compression: bool = False, dictionary: bytes = None,
+                 threshold: int = COMPRESSION_THRESHOLD):
+        self.compression = compression
+        self.dictionary = dictionary
+        self.threshold = threshold
+        zdict = zlib_dictionary(dictionary)
+        self.compressor = compressobj(COMPRESSION_LEVEL, **zdict) if compression else None
+        self.decompressor = decompressobj(**zdict) if compression else None
+
+    def encode(self, message: Any) -> bytes:
+        if isinstance(message, EncodedMessage):
+            if self.compression and len(message.payload) >= self.threshold:
+                return message.compressed_frame(self.dictionary)
+            return message.frame
+        payload = dumps(message)
+        if self.compression and len(payload) >= self.threshold:
+            payload = self.compressor.compress(payload) + self.compressor.flush(Z_SYNC_FLUSH)
+            return HEADER.pack(len(payload), COMPRESSED) + payload
+        return HEADER.pack(len(payload), 0) + payload
+
+    def decode(self, payload: memoryview, flags: int) -> Any:
+        if flags & COMPRESSED:
+            return loads(self.decompressor.decompress(payload))
+        if flags & COMPRESSED_ALONE:
+            return loads(decompressobj(**zlib_dictionary(self.dictionary)).decompress(payload))
+        return loads(payload)
+
+
+PLAIN = MessageCodec()
+
+
+def encode_message(message: Any, codec: MessageCodec = PLAIN) -> bytes:
+    """
+    Encode 'message' and prefix it with its length and flags, so the
+    receiving side can find message boundaries in the TCP stream.
+    """
+    return codec.encode(message)
+
+
+def send_message(connection: socket, message: Any, codec: MessageCodec = PLAIN):
+    connection.sendall(codec.encode(message))
+
+
+class MessageReceiver:
+    """
+    Receives length-prefixed messages from the connection into one,
+    preallocated buffer and unpickles them straight from the memoryview of
+    that buffer, so no intermediate bytes objects are created per message.
+
+    Unread bytes are moved to the beginning of the buffer only when there is
+    not enough room left for the rest of the currently received message. The
+    buffer grows only when a single message is bigger than it.
+    """
+
+    def __init__(self, connection: socket, buffer_size: int = RECEIVE_BUFFER_SIZE, codec: MessageCodec = PLAIN):
+        self.connection = connection
+        self.codec = codec
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # index of the first not consumed byte
+        self.end = 0  # index after the last received byte
+
+    @property
+    def buffered(self) -> int:
+        return self.end - self.start
+
+    def receive(self) -> Any:
+        """
+        Block until the whole message is received and return it unpickled.
+
+        :raises EOFError: when connection was closed by the other side
+        """
+        self.fill(HEADER.size)
+        size, flags = HEADER.unpack_from(self.buffer, self.start)
+        self.fill(HEADER.size + size)
+        start = self.start + HEADER.size
+        self.start = start + size
+        return self.codec.decode(self.view[start:self.start], flags)
+
+    def fill(self, required: int):
+        if self.buffered >= required:
+            return
+        self.make_room_for(required)
+        while self.buffered < required:
+            if not (received := self.connection.recv_into(self.view[self.end:])):
+                raise EOFError('Connection closed by the remote side.')
+            self.end += received
+
+    def make_room_for(self, required: int):
+        if self.start + required <= len(self.buffer):
+            return
+        buffered = self.buffered
+        if required > len(self.buffer):
+            self.grow(max(required, 2 * len(self.buffer)))
+        else:
+            self.view[:buffered] = self.view[self.start:self.end]
+        self.start, self.end = 0, buffered
+
+    def grow(self, size: int):
+        buffer = bytearray(size)
+        buffer[:self.buffered] = self.view[self.start:self.end]
+        self.view.release()
+        self.buffer, self.view = buffer, memoryview(buffer)
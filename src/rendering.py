@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+"""
+Drawing of the game objects. Kept apart from the game model, so the headless
+server never imports arcade, which is loaded only by the client.
+"""
+from __future__ import annotations
+
+import arcade
+
+WHITE = (255, 255, 255)
+
+
+def draw_player(player):
+    arcade.draw_rectangle_filled(*player.position, *player.size, player.color, -player.angle)
+    draw_weapon(player.weapon)
+
+
+def draw_weapon(weapon):
+    arcade.draw_circle_filled(*weapon.start, radius=8, color=WHITE)
+    arcade.draw_line(*weapon.start, *weapon.end, color=WHITE, line_width=3)
+
+
+def draw_projectile(projectile):
+    arcade.draw_point(*projectile.position, projectile.color, projectile.size)
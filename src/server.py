@@ -1,19 +1,42 @@
 #!/usr/bin/env python
 
-from typing import List
-from threading import Thread
-from pickle import dumps, loads
+from typing import Dict, List, Optional, Tuple
+from threading import Thread, Lock
+from select import select
 from socket import (
-    socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, gethostname, gethostbyname, error as socket_error
+    socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY, gethostname, gethostbyname,
+    error as socket_error, timeout as socket_timeout
 )
 
-from game import Game, Player, Projectile
+from actors import GameActor, GameWorker, JoinRequest, LeaveRequest
+from compression import compressing_codec, dictionary_checksum
+from connections import ConnectionWriter
+from game import Game, MapRequest, MapState, Player, Projectile
+from protocol import MessageCodec, MessageReceiver, send_message, PLAIN, RECEIVE_BUFFER_SIZE
 from simple_logging import log, clear_log_file
 
 
+GAME_WORKERS = 2
+SPECTATOR_WAIT_TIMEOUT = 1.0
+MAX_CONNECTIONS = 64
+LISTEN_BACKLOG = 32
+HANDSHAKE_TIMEOUT = 5.0  # seconds a new connection has to send its game request
+CLIENT_TIMEOUT = 10.0  # idle clients, and clients not accepting data for that long, are evicted
+
+
 class Server:
-    def __init__(self):
+    def __init__(self, workers: int = GAME_WORKERS, compression: bool = True,
+                 max_connections: int = MAX_CONNECTIONS, backlog: int = LISTEN_BACKLOG):
+        self.compression = compression
+        self.max_connections = max_connections
+        self.backlog = backlog
+        self.connections_count = 0
+        self.connections_lock = Lock()
         self.games: List[Game] = []
+        self.games_count = 0  # games are removed when all players leave, so their count does not give a new id
+        self.actors: Dict[Game, GameActor] = {}
+        self.games_lock = Lock()
+        self.workers = [GameWorker(name=f'game-worker-{i}') for i in range(workers)]
         self.server_ip_address = gethostbyname(gethostname())
         self.port = 5555
         self.socket = socket(AF_INET, SOCK_STREAM)
@@ -30,51 +53,147 @@ class Server:
             return False
 
     def run_server(self):
-        self.socket.listen(4)
+        for worker in self.workers:
+            worker.start()
+        self.socket.listen(self.backlog)
         log('Server started, waiting for the connections.', console=True)
         while True:
             try:
                 connection, address = self.socket.accept()
+                if not self.admit_connection():
+                    self.reject_connection(connection, address[0], 'Server is full, try again later.')
+                    continue
+                connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
                 thread = Thread(target=self.threaded_client, args=(connection, address[0]), daemon=False)
                 thread.start()
             except KeyboardInterrupt:
                 break
         self.socket.close()
 
-    def threaded_client(self, connection: socket, address: str):
-        log(f'Received connection from: {address}')
-
-        game_request = loads(connection.recv(128))
-        game_name, max_players = game_request['game_name'], game_request['max_players']
+    def admit_connection(self) -> bool:
+        with self.connections_lock:
+            if self.connections_count >= self.max_connections:
+                return False
+            self.connections_count += 1
+            return True
 
-        game = self.add_client_to_game(address, game_name, max_players)
-        self.send_client_response_with_game_and_player_id(connection, game)
+    def release_connection(self):
+        with self.connections_lock:
+            self.connections_count -= 1
 
-        self.play_game_until_disconnected_or_dead(address, connection, game)
+    @staticmethod
+    def reject_connection(connection: socket, address: str, reason: str):
+        log(f'Rejected connection from: {address}, {reason}')
+        try:
+            connection.settimeout(0)  # rejection is tiny and fits into the empty socket buffer, or is not sent at all
+            send_message(connection, {'rejected': reason})
+        except OSError:
+            pass
+        connection.close()
 
-        if game in self.games and not game.players:
-            self.games.remove(game)
+    def threaded_client(self, connection: socket, address: str):
+        log(f'Received connection from: {address}')
+        try:
+            connection.settimeout(HANDSHAKE_TIMEOUT)
+            receiver = MessageReceiver(connection)
+            try:
+                game_request = receiver.receive()
+            except (EOFError, OSError) as e:
+                return log(f'No game request from {address}: {e}')
+            connection.settimeout(CLIENT_TIMEOUT)
+            if 'spectate' in game_request:
+                return self.threaded_spectator(connection, address, game_request)
+            self.threaded_player(connection, address, receiver, game_request)
+        finally:
+            connection.close()
+            self.release_connection()
+
+    def threaded_player(self, connection: socket, address: str, receiver: MessageReceiver, game_request: dict):
+        game_name, max_players = game_request['game_name'], game_request['max_players']
 
-        log(f'Disconnected with {address}')
+        game, player, map_state = self.add_client_to_game(address, game_name, max_players)
+        actor = self.actors[game]
+        codec = self.negotiate_codec(game_request.get('compression'))
+        writer = ConnectionWriter(connection, codec, address)
+        try:
+            self.send_client_response_with_game_and_player_id(connection, player, map_state, codec)
+            receiver.codec = codec
+            writer.start()
+            self.play_game_until_disconnected_or_dead(address, receiver, writer, actor)
+        finally:
+            # also after malformed messages, or errors re-raised by the GameWorker
+            writer.close()
+            with self.games_lock:  # so no one joins the Game between the decision and its removal
+                if actor.call(LeaveRequest(player.id)):
+                    self.games.remove(game)
+                    del self.actors[game]
+
+            log(f'Disconnected with {address}')
+
+    def threaded_spectator(self, connection: socket, address: str, spectator_request: dict):
+        codec = self.negotiate_codec(spectator_request.get('compression'))
+        with self.games_lock:
+            actor = self.find_spectated_game(spectator_request['spectate'])
+        game_name, map_state = (None, None) if actor is None else (actor.game.name, actor.call(MapRequest(0)))
+        send_message(connection, {'game': game_name, 'map': map_state, 'compression': codec.compression})
+        if actor is not None:
+            log(f'{address} spectates game: {actor.game.id}')
+            writer = ConnectionWriter(connection, codec, address)
+            writer.start()
+            try:
+                self.send_snapshots_until_disconnected_or_finished(connection, writer, actor)
+            finally:
+                writer.close()
+        log(f'Disconnected with spectator {address}')
+
+    def find_spectated_game(self, game_name: str = None) -> Optional[GameActor]:
+        for game in (g for g in self.games if game_name is None or g.name == game_name):
+            return self.actors[game]
+
+    def send_snapshots_until_disconnected_or_finished(self, connection: socket, writer: ConnectionWriter,
+                                                      actor: GameActor):
+        tick = 0
+        while actor.game in self.games and not writer.closed:
+            tick, encoded_snapshot = actor.wait_for_snapshot(tick, SPECTATOR_WAIT_TIMEOUT)
+            if encoded_snapshot is not None:
+                writer.send_snapshot(encoded_snapshot)
+            elif self.is_disconnected(connection):
+                # writer notices dead connection only when sending, and Game could publish nothing for long
+                break
 
-        connection.close()
+    @staticmethod
+    def is_disconnected(connection: socket) -> bool:
+        """Check, without blocking, if the client, which sends nothing after handshake, closed connection."""
+        try:
+            if select([connection], [], [], 0)[0]:
+                return not connection.recv(RECEIVE_BUFFER_SIZE)  # anything else sent by spectator is ignored
+        except OSError:
+            return True
+        return False
 
-    def play_game_until_disconnected_or_dead(self, address, connection, game):
-        while True:
+    def play_game_until_disconnected_or_dead(self, address, receiver: MessageReceiver, writer: ConnectionWriter,
+                                             actor: GameActor):
+        while not writer.closed:
             try:
-                if received := loads(connection.recv(2048)):
-                    log(f'Game: {game.id}, received data: {received} from {address}')
-                    self.process_and_response(game, received, connection)
+                if received := receiver.receive():
+                    log(f'Game: {actor.game.id}, received data: {received} from {address}')
+                    self.process_and_response(actor, received, writer)
                 else:
                     break
+            except socket_timeout:
+                writer.evict(f'idle for {CLIENT_TIMEOUT} seconds')
+                break
             except (EOFError, ConnectionError) as e:
                 log(str(e))
                 break
 
-    def add_client_to_game(self, client_ip_address, game_name=None, max_players=4) -> Game:
-        game = self.get_game_instance(game_name, max_players)
-        game.join_new_player(client_ip_address)
-        return game
+    def add_client_to_game(self, client_ip_address, game_name=None, max_players=4) -> Tuple[Game, Player, MapState]:
+        with self.games_lock:
+            while True:
+                game = self.get_game_instance(game_name, max_players)
+                if (joined := self.actors[game].call(JoinRequest(client_ip_address))) is not None:
+                    return (game, *joined)
+                game_name = None  # private game is full, fall back to the public one
 
     def get_game_instance(self, game_name, max_players) -> Game:
         if game_name is not None:
@@ -94,24 +213,30 @@ class Server:
         return self.create_new_game(max_players)
 
     def create_new_game(self, game_name: str = None, max_players: int = 4) -> Game:
-        new_game = Game(game_id=len(self.games), name=game_name, max_players=max_players)
+        new_game = Game(game_id=self.games_count, name=game_name, max_players=max_players)
+        self.games_count += 1
         self.games.append(new_game)
+        worker = self.workers[new_game.id % len(self.workers)]
+        self.actors[new_game] = GameActor(new_game, worker)
         return new_game
 
-    def send_client_response_with_game_and_player_id(self, connection: socket, game: Game):
-        connection.send(dumps(game.last_added_player()))
-
-    def process_and_response(self, game: Game, received: Player or Projectile, connection: socket):
-        if isinstance(received, Player):
-            game.update_player(received)
-
-            if game.players:
-                other_players, projectiles = game.get_other_players_and_projectiles(received)
-                connection.sendall(dumps((other_players, projectiles)))
-            else:
-                connection.sendall(str.encode('w'))
-        elif isinstance(received, Projectile):
-            game.update_projectiles(received)
+    def negotiate_codec(self, offered_dictionary_checksum: int = None) -> MessageCodec:
+        if self.compression and offered_dictionary_checksum == dictionary_checksum():
+            return compressing_codec()
+        return PLAIN
+
+    @staticmethod
+    def send_client_response_with_game_and_player_id(connection: socket, player: Player, map_state: MapState,
+                                                     codec: MessageCodec):
+        send_message(connection, {'player': player, 'map': map_state, 'compression': codec.compression})
+
+    @staticmethod
+    def process_and_response(actor: GameActor, received: Tuple[Player or Projectile, ...], writer: ConnectionWriter):
+        if (map_request := next((m for m in received if isinstance(m, MapRequest)), None)) is not None:
+            writer.send(actor.call(map_request))
+        actor.post(received)
+        if any(isinstance(game_object, Player) for game_object in received):
+            writer.send_snapshot(actor.encoded_snapshot)
 
 
 if __name__ == '__main__':
@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 
-from typing import List, Tuple, Sequence
+from itertools import chain
+from typing import Dict, List, Tuple, Sequence
 
 from math import hypot as hypotenuse
 
-import arcade
-
-from game import GameObject
+from game import GameObject, Obstacle
+from geometry import is_point_in_polygon
 
 
 EPSILON = 0.005
@@ -98,19 +98,29 @@ class VisibleArea:
     def __init__(self):
         self.observer_position = (0, 0)
         self.visible_polygon = []
-        self.walls = []
+        self.walls: Dict[int, List[Tuple]] = {}  # walls of each visible obstacle, by obstacle id
 
     def __contains__(self, item: GameObject) -> bool:
         x, y = item.position
-        if arcade.is_point_in_polygon(x, y, self.visible_polygon):
+        if is_point_in_polygon(x, y, self.visible_polygon):
             visibility_line = self.observer_position, item.position
-            return not any(intersects(visibility_line, wall) for wall in self.walls)
+            return not any(intersects(visibility_line, wall) for wall in chain.from_iterable(self.walls.values()))
         return False
 
-    def update(self, observer_position: Tuple[float, float], visible_area: List, obstacles: List):
+    def update(self, observer_position: Tuple[float, float], visible_area: List, obstacles: List[Obstacle]):
+        """
+        Walls are replaced only for obstacles which became visible, or were
+        damaged (and therefore are new Obstacle instances) since last update.
+        """
         self.observer_position = observer_position
         self.visible_polygon = visible_area
-        self.walls.clear()
-        for obstacle in obstacles:
-            self.walls.extend((obstacle[i], obstacle[i + 1]) for i in range(len(obstacle) - 1))
-            self.walls.append((obstacle[-1], obstacle[0]))
+        visible = {obstacle.id: obstacle for obstacle in obstacles}
+        for obstacle_id in self.walls.keys() - visible.keys():
+            del self.walls[obstacle_id]
+        for obstacle_id, obstacle in visible.items():
+            if self.walls.get(obstacle_id) is not obstacle.walls:
+                self.walls[obstacle_id] = obstacle.walls
+
+    def replace_obstacle(self, obstacle_id: int, parts: List[Obstacle]):
+        if self.walls.pop(obstacle_id, None) is not None:
+            self.walls.update((part.id, part.walls) for part in parts)